@@ -35,17 +35,24 @@ To model diversity and no-click, one can choose one from the following options:
   --Calculate the scores of all items, and if none of them exceeds a given
     threshold, no item is selected by the user.
 
+With the multi-click feedback model and ghost actions, the ghost items are not
+used: every recommended item is clicked independently, with probability the
+sigmoid of its noisy score.
+
 """
-from typing import Optional, Callable, Sequence, Text
+import functools
+from typing import Any, Optional, Callable, Sequence, Text
 
 import numpy as np
-import tensorflow as tf
 
 from tf_agents.bandits.environments import bandit_py_environment
 from tf_agents.bandits.specs import utils as bandit_spec_utils
+from tf_agents.environments import parallel_py_environment
+from tf_agents.environments import py_environment
 from tf_agents.specs import array_spec
 from tf_agents.trajectories import time_step as ts
 from tf_agents.typing import types
+from tf_agents.utils import nest_utils
 
 GLOBAL_KEY = bandit_spec_utils.GLOBAL_FEATURE_KEY
 PER_ARM_KEY = bandit_spec_utils.PER_ARM_FEATURE_KEY
@@ -60,6 +67,11 @@ class FeedbackModel(object):
   # Score Vector feedback model: Every element in the output ranking receives a
   # score value.
   SCORE_VECTOR = 2
+  # Multi-click feedback model: The user is not modeled as a cascade; every
+  # element in the output ranking is clicked or not, independently of its
+  # position and of the other elements. The feedback is a score vector of zeros
+  # and ones.
+  MULTI_CLICK = 3
 
 
 class ClickModel(object):
@@ -91,7 +103,15 @@ class RankingPyEnvironment(
                real_cascade: bool = False,
                distance_threshold: Optional[float] = None,
                batch_size: Optional[int] = 1,
-               name: Optional[Text] = 'ranking_environment'):
+               name: Optional[Text] = 'ranking_environment',
+               global_sampling_fn_batched: Optional[
+                   Callable[[int], types.Array]] = None,
+               item_sampling_fn_batched: Optional[
+                   Callable[[int], types.Array]] = None,
+               seed: Optional[int] = None,
+               dtype: Optional[np.dtype] = None,
+               global_dim: Optional[int] = None,
+               item_dim: Optional[int] = None):
     """Initializes the environment.
 
     In each round, global context is generated by global_sampling_fn, item
@@ -115,9 +135,17 @@ class RankingPyEnvironment(
       num_slots: (int) the number of items recommended in every round.
       scores_weight_matrix: A tensor of shape `[item_dim, global_dim]`. The
         score of an item is calculated as `global * M * item + noise`.
-      feedback_model: The type of feedback model. Currently only implemented is
+      feedback_model: The type of feedback model. Implemented models are:
         -- `cascading`: the feedback is a tuple `(k, v)`, where `k` is the
            index of the chosen item, and `v` is the value of the choice.
+        -- `score_vector`: the cascading feedback, converted to a vector of
+           length `num_slots` with the value of the choice at index `k`.
+        -- `multi_click`: the feedback is a vector of length `num_slots`, with
+           ones for all clicked items. With `ghost_actions`, every item is
+           clicked independently with probability the sigmoid of its noisy
+           score, and the ghost items are not used. With `distance_based`,
+           every item whose score reaches the threshold is clicked. Cannot be
+           combined with `real_cascade`.
       click_model: The way the environment models that diversity is desired.
         -- `ghost_actions`: For every dimension of the item space, a unit vector
            is added to the list of available items. If one of these unit-vector
@@ -130,14 +158,54 @@ class RankingPyEnvironment(
         this threshold governs if the user actually clicked on any of the items.
       batch_size: The batch size.
       name: The name of this environment instance.
+      global_sampling_fn_batched: An optional vectorized version of
+        `global_sampling_fn`. Called with an integer `n`, it outputs an array of
+        shape `[n, global_dim]`. If set, it is used instead of calling
+        `global_sampling_fn` once per batch element.
+      item_sampling_fn_batched: An optional vectorized version of
+        `item_sampling_fn`. Called with an integer `n`, it outputs an array of
+        shape `[n, item_dim]`. If set, it is used instead of calling
+        `item_sampling_fn` once per item.
+      seed: An optional seed for the random number generator of the user
+        model. The sampling functions use their own source of randomness.
+      dtype: If set, the observations and the scores weight matrix are cast to
+        this dtype, e.g. `np.float32` to score in single precision. If `None`,
+        the dtype of the sampling functions' outputs is kept.
+      global_dim: (int) The dimension of the global features. Must be set
+        together with `item_dim` and `dtype`, and then the observation spec is
+        built from them, and the sampling functions are not called to infer it.
+        This saves sampler calls when many environments are constructed, e.g.
+        for the shards of a `ShardedRankingPyEnvironment`.
+      item_dim: (int) The dimension of the item features. See `global_dim`.
+
+    Raises:
+      ValueError: If `feedback_model` is `MULTI_CLICK` and `real_cascade` is
+        set, if only one of `global_dim` and `item_dim` is set or they are set
+        without `dtype`, or if the shape of `scores_weight_matrix` is not
+        `[item_dim, global_dim]`.
     """
+    if feedback_model == FeedbackModel.MULTI_CLICK and real_cascade:
+      raise ValueError('The multi-click feedback model does not support '
+                       '`real_cascade`.')
+    explicit_dims = global_dim is not None or item_dim is not None
+    if explicit_dims and (global_dim is None or item_dim is None or
+                          dtype is None):
+      raise ValueError(
+          '`global_dim`, `item_dim` and `dtype` must be set together, got '
+          'global_dim={}, item_dim={}, dtype={}.'.format(
+              global_dim, item_dim, dtype))
     self._global_sampling_fn = global_sampling_fn
     self._item_sampling_fn = item_sampling_fn
+    self._global_sampling_fn_batched = global_sampling_fn_batched
+    self._item_sampling_fn_batched = item_sampling_fn_batched
     self._num_items = num_items
     self._num_slots = num_slots
-    self._scores_weight_matrix = scores_weight_matrix
+    self._scores_weight_matrix = np.ascontiguousarray(
+        scores_weight_matrix, dtype=dtype)
+    self._dtype = dtype
     self._feedback_model = feedback_model
     self._batch_size = batch_size
+    self._batch_range = np.arange(batch_size)
     self._click_model = click_model
     if click_model == ClickModel.DISTANCE_BASED:
       assert distance_threshold is not None, (
@@ -145,14 +213,41 @@ class RankingPyEnvironment(
           'the distance threshold must be set.')
     self._distance_threshold = distance_threshold
     self._real_cascade = real_cascade
+    self._rng = np.random.default_rng(seed)
 
-    global_spec = array_spec.ArraySpec.from_array(global_sampling_fn())
-    item_spec = array_spec.add_outer_dims_nest(
-                array_spec.ArraySpec.from_array(item_sampling_fn()),
-                (num_items,))
+    if explicit_dims:
+      global_spec = array_spec.ArraySpec((global_dim,), dtype)
+      single_item_spec = array_spec.ArraySpec((item_dim,), dtype)
+    else:
+      global_spec = array_spec.ArraySpec.from_array(global_sampling_fn())
+      single_item_spec = array_spec.ArraySpec.from_array(item_sampling_fn())
+      if dtype is not None:
+        global_spec = array_spec.ArraySpec(global_spec.shape, dtype)
+        single_item_spec = array_spec.ArraySpec(single_item_spec.shape, dtype)
+    item_spec = array_spec.add_outer_dims_nest(single_item_spec, (num_items,))
     observation_spec = {GLOBAL_KEY: global_spec, PER_ARM_KEY: item_spec}
     self._global_dim = global_spec.shape[0]
     self._item_dim = item_spec.shape[-1]
+    if self._scores_weight_matrix.shape != (self._item_dim, self._global_dim):
+      raise ValueError(
+          'The shape of `scores_weight_matrix` must be [item_dim, global_dim] '
+          '= [{}, {}], got {}.'.format(self._item_dim, self._global_dim,
+                                       list(self._scores_weight_matrix.shape)))
+
+    # The dtype of the noisy scores, a float even for integer features.
+    self._scores_dtype = np.result_type(global_spec.dtype, item_spec.dtype,
+                                        self._scores_weight_matrix.dtype,
+                                        np.float32)
+    # Buffers reused by every step of the single-click ghost actions model.
+    # They never leave the environment; rewards are always built in fresh
+    # arrays.
+    if (click_model == ClickModel.GHOST_ACTIONS and
+        feedback_model != FeedbackModel.MULTI_CLICK):
+      scores_shape = [batch_size, num_slots + self._item_dim]
+      self._buf_scores = np.empty(scores_shape, dtype=self._scores_dtype)
+      self._buf_noise = np.empty(scores_shape, dtype=self._scores_dtype)
+      self._buf_uniforms = np.empty(scores_shape, dtype=self._scores_dtype)
+      self._buf_chosen_idx = np.empty([batch_size], dtype=np.int64)
 
     action_spec = array_spec.BoundedArraySpec(
         shape=(num_slots,),
@@ -175,12 +270,19 @@ class RankingPyEnvironment(
               array_spec.ArraySpec(
                   shape=[], dtype=np.float32, name='chosen_value')
       }
-    elif feedback_model == FeedbackModel.SCORE_VECTOR:
+    elif feedback_model in (FeedbackModel.SCORE_VECTOR,
+                            FeedbackModel.MULTI_CLICK):
       reward_spec = array_spec.ArraySpec(
           shape=[num_slots], dtype=np.float32, name='score_vector')
     else:
       raise NotImplementedError(
           'Feedback model {} not implemented'.format(feedback_model))
+    # The reward dtypes are cached so that `_step` can cast the rewards without
+    # traversing the reward spec.
+    if isinstance(reward_spec, dict):
+      self._reward_dtypes = {k: v.dtype for k, v in reward_spec.items()}
+    else:
+      self._reward_dtypes = reward_spec.dtype
 
     super(RankingPyEnvironment, self).__init__(
         observation_spec, action_spec, reward_spec, name=name)
@@ -193,12 +295,24 @@ class RankingPyEnvironment(
     return self._batch_size
 
   def _observe(self) -> types.NestedArray:
-    global_obs = np.stack(
-        [self._global_sampling_fn() for _ in range(self._batch_size)])
-    item_obs = np.reshape([
-        self._item_sampling_fn()
-        for _ in range(self._batch_size * self._num_items)
-    ], (self._batch_size, self._num_items, -1))
+    if self._global_sampling_fn_batched is not None:
+      global_obs = np.asarray(
+          self._global_sampling_fn_batched(self._batch_size))
+    else:
+      global_obs = np.stack(
+          [self._global_sampling_fn() for _ in range(self._batch_size)])
+    if self._item_sampling_fn_batched is not None:
+      item_obs = np.reshape(
+          self._item_sampling_fn_batched(self._batch_size * self._num_items),
+          (self._batch_size, self._num_items, -1))
+    else:
+      item_obs = np.reshape([
+          self._item_sampling_fn()
+          for _ in range(self._batch_size * self._num_items)
+      ], (self._batch_size, self._num_items, -1))
+    if self._dtype is not None:
+      global_obs = global_obs.astype(self._dtype, copy=False)
+      item_obs = item_obs.astype(self._dtype, copy=False)
     self._observation = {GLOBAL_KEY: global_obs, PER_ARM_KEY: item_obs}
     return self._observation
 
@@ -207,12 +321,19 @@ class RankingPyEnvironment(
       raise ValueError('Number of actions must match batch size.')
     global_obs = self._observation[GLOBAL_KEY]
     item_obs = self._observation[PER_ARM_KEY]
-    batch_size_range = range(self.batch_size)
-    slotted_items = item_obs[np.expand_dims(batch_size_range, axis=1), action]
+    slotted_items = np.take_along_axis(
+        item_obs, action[:, :, np.newaxis], axis=1)
+    # The score of an item is `global * M^T * item`. Projecting the globals
+    # once is cheaper than projecting every slotted item.
+    global_proj = np.matmul(global_obs, self._scores_weight_matrix.T)
+    if self._feedback_model == FeedbackModel.MULTI_CLICK:
+      return self._click_vector(global_proj, slotted_items)
+
     if self._click_model == ClickModel.GHOST_ACTIONS:
-      chosen_items = self._choose_items_ghost_actions(global_obs, slotted_items)
+      chosen_items = self._choose_items_ghost_actions(global_proj,
+                                                      slotted_items)
     elif self._click_model == ClickModel.DISTANCE_BASED:
-      chosen_items = self._choose_items_distance_based(global_obs,
+      chosen_items = self._choose_items_distance_based(global_proj,
                                                        slotted_items)
     else:
       raise NotImplementedError('Diversity model {} not implemented'.format(
@@ -226,10 +347,20 @@ class RankingPyEnvironment(
       chosen_values = (chosen_items < self._num_slots).astype(np.float32)
       return self._cascading_to_scorevector(chosen_items, chosen_values)
 
+  def _click_vector(self, global_proj, slotted_items):
+    if self._click_model == ClickModel.GHOST_ACTIONS:
+      clicks = self._choose_clicks_ghost_actions(global_proj, slotted_items)
+    elif self._click_model == ClickModel.DISTANCE_BASED:
+      scores = self._batched_inner_product(global_proj, slotted_items)
+      clicks = scores >= self._distance_threshold
+    else:
+      raise NotImplementedError('Diversity model {} not implemented'.format(
+          self._click_model))
+    return clicks.astype(np.float32)
+
   def _cascading_to_scorevector(self, chosen_items, chosen_values):
     scores = np.zeros((self.batch_size, self._num_slots + 1), dtype=np.float32)
-    r = np.arange(self.batch_size)
-    scores[r, chosen_items] = chosen_values
+    scores[self._batch_range, chosen_items] = chosen_values
     return scores[:, :-1]  # The last column is for samples with no click.
 
   def _step(self, action):
@@ -238,54 +369,249 @@ class RankingPyEnvironment(
     # Sort this out with TF-Agents.
     output = super(RankingPyEnvironment, self)._step(action)
     reward = output.reward
-    new_reward = tf.nest.map_structure(lambda x, t: x.astype(t), reward,
-                                       self.reward_spec())
+    if isinstance(self._reward_dtypes, dict):
+      new_reward = {
+          k: reward[k].astype(dtype, copy=False)
+          for k, dtype in self._reward_dtypes.items()
+      }
+    else:
+      new_reward = reward.astype(self._reward_dtypes, copy=False)
     return ts.TimeStep(
         step_type=output.step_type,
         reward=new_reward,
         discount=output.discount,
         observation=output.observation)
 
-  def _batched_inner_product(self, global_obs, item_obs):
-    left = np.matmul(item_obs, self._scores_weight_matrix)
-    expanded_left = np.expand_dims(left, axis=-2)
-    expanded_globals = np.reshape(
-        global_obs, newshape=[self._batch_size, 1, self._global_dim, 1])
-    scores = np.reshape(
-        np.matmul(expanded_left, expanded_globals),
-        newshape=[self._batch_size, -1])
-    return scores
+  def _batched_inner_product(self, global_proj, items, out=None):
+    """Scores of items, given the globals projected by the weights.
+
+    Args:
+      global_proj: An array of shape `[batch_size, item_dim]`, the product of
+        the global features with the transposed scores weight matrix.
+      items: An array of shape `[batch_size, k, item_dim]`.
+      out: An optional array of shape `[batch_size, k]` to write the scores
+        into.
+
+    Returns:
+      The scores, an array of shape `[batch_size, k]`.
+    """
+    return np.einsum('bki,bi->bk', items, global_proj, out=out)
+
+  def _ghost_actions_scores(self, global_proj, slotted_items):
+    """Returns the scores of the slotted and the ghost items, and the noise.
+
+    Args:
+      global_proj: An array of shape `[batch_size, item_dim]`, the product of
+        the global features with the transposed scores weight matrix.
+      slotted_items: An array of shape `[batch_size, num_slots, item_dim]`.
+
+    Returns:
+      A tuple `(scores, normal_noise, uniforms)` of arrays of shape
+      `[batch_size, num_slots + item_dim]`: the scores, the standard normal
+      noise to perturb them with, and uniform samples from `[0, 1)` for the
+      Gumbel noise.
+    """
+    # If one of the unit vectors gets chosen, it means no-click. The score of
+    # the unit vector `e_i` is `global * M^T * e_i`, that is, the `i`-th
+    # element of `global_proj`, so the ghost items need not be materialized.
+    scores = self._buf_scores
+    self._batched_inner_product(
+        global_proj, slotted_items, out=scores[:, :self._num_slots])
+    scores[:, self._num_slots:] = global_proj
+    normal_noise = self._rng.standard_normal(
+        dtype=scores.dtype, out=self._buf_noise)
+    uniforms = self._rng.random(dtype=scores.dtype, out=self._buf_uniforms)
+    return scores, normal_noise, uniforms
+
+  def _gumbel_perturbed_logits(self, scores, normal_noise, uniforms):
+    """Returns Gumbel-perturbed click logits, overwriting the inputs.
+
+    The user clicks on an index with probability proportional to the sigmoid of
+    its noisy score. By the Gumbel-max trick, `argmax(l + g)` with standard
+    Gumbel noise `g` samples index `j` with probability proportional to
+    `exp(l_j)`, so `l = log(sigmoid(x))` needs no normalization.
+
+    Args:
+      scores: The scores returned by `_ghost_actions_scores`.
+      normal_noise: The normal noise returned by `_ghost_actions_scores`.
+      uniforms: The uniform samples returned by `_ghost_actions_scores`.
 
-  def _choose_items_ghost_actions(self, global_obs, slotted_items):
-    # If one of the unit vectors gets chosen, it means no-click.
-    slotted_items_with_units = np.concatenate([
-        slotted_items,
-        np.broadcast_to(
-            np.identity(self._item_dim),
-            [self._batch_size, self._item_dim, self._item_dim])
-    ],
-                                              axis=1)
-
-    scores = self._batched_inner_product(global_obs, slotted_items_with_units)
-    perturbed_scores = np.random.normal(loc=scores, scale=1)
-    unnormalized_probabilities = 1 / (1 + np.exp(-perturbed_scores))
-    probabilities = unnormalized_probabilities / np.expand_dims(
-        np.linalg.norm(unnormalized_probabilities, ord=1, axis=-1), axis=1)
-
-    return np.minimum([
-        np.random.choice(np.arange(self._num_slots + self._item_dim), p=p)
-        for p in probabilities
-    ], self._num_slots)
-
-  def _choose_items_distance_based(self, global_obs, slotted_items):
-    scores = self._batched_inner_product(global_obs, slotted_items)
-    scores = np.concatenate(
-        [scores,
-         np.ones([self._batch_size, 1]) * self._distance_threshold], axis=1)
+    Returns:
+      The perturbed logits, with the same shape as `scores`.
+    """
+    perturbed_scores = np.add(scores, normal_noise, out=scores)
+    # `log(sigmoid(x)) = -log(1 + exp(-x))`, computed stably and in place.
+    log_sigmoid_scores = np.negative(perturbed_scores, out=perturbed_scores)
+    np.logaddexp(0, log_sigmoid_scores, out=log_sigmoid_scores)
+    np.negative(log_sigmoid_scores, out=log_sigmoid_scores)
+    # Standard Gumbel noise `-log(-log(u))`, computed in place. It needs
+    # `0 < u < 1`; the uniform samples are below 1 but can be exactly 0, so
+    # they are first moved to the smallest positive float.
+    gumbel_noise = np.maximum(
+        uniforms, np.finfo(uniforms.dtype).tiny, out=uniforms)
+    np.log(gumbel_noise, out=gumbel_noise)
+    np.negative(gumbel_noise, out=gumbel_noise)
+    np.log(gumbel_noise, out=gumbel_noise)
+    np.negative(gumbel_noise, out=gumbel_noise)
+    return np.add(log_sigmoid_scores, gumbel_noise, out=log_sigmoid_scores)
+
+  def _choose_items_ghost_actions(self, global_proj, slotted_items):
+    scores, normal_noise, uniforms = self._ghost_actions_scores(
+        global_proj, slotted_items)
+    logits = self._gumbel_perturbed_logits(scores, normal_noise, uniforms)
+    chosen_items = np.argmax(logits, axis=1, out=self._buf_chosen_idx)
+    return np.minimum(chosen_items, self._num_slots, out=chosen_items)
+
+  def _choose_clicks_ghost_actions(self, global_proj, slotted_items):
+    """Returns a boolean array of shape `[batch_size, num_slots]` of clicks.
+
+    Every slotted item is clicked independently, with probability the sigmoid
+    of its noisy score, so any number of clicks, including none, can occur.
+
+    Args:
+      global_proj: An array of shape `[batch_size, item_dim]`, the product of
+        the global features with the transposed scores weight matrix.
+      slotted_items: An array of shape `[batch_size, num_slots, item_dim]`.
+    """
+    scores = self._batched_inner_product(global_proj, slotted_items)
+    # The noisy scores are computed in `_scores_dtype`, as the inner products
+    # are integers when the features and the weights are.
+    scores = np.add(
+        scores,
+        self._rng.standard_normal(scores.shape, dtype=self._scores_dtype),
+        dtype=self._scores_dtype)
+    # `sigmoid(x) = exp(-log(1 + exp(-x)))`, computed without overflow.
+    click_probs = np.exp(-np.logaddexp(0, -scores))
+    return self._rng.random(
+        scores.shape, dtype=self._scores_dtype) < click_probs
+
+  def _choose_items_distance_based(self, global_proj, slotted_items):
+    scores = self._batched_inner_product(global_proj, slotted_items)
+    # Index `num_slots` means that no score reached the threshold.
     if self._real_cascade:
-      return np.array(
-          [np.min(np.where(s >= self._distance_threshold)) for s in scores])
-    return np.argmax(scores, axis=1)
+      # The user clicks on the first item that reaches the threshold.
+      relevant = scores >= self._distance_threshold
+      return np.where(
+          np.any(relevant, axis=1), np.argmax(relevant, axis=1),
+          self._num_slots)
+    # The user clicks on the best item if it reaches the threshold.
+    best_items = np.argmax(scores, axis=1)
+    best_scores = np.take_along_axis(
+        scores, best_items[:, np.newaxis], axis=1)[:, 0]
+    return np.where(best_scores >= self._distance_threshold, best_items,
+                    self._num_slots)
+
+
+def _create_ranking_environment_shard(shard_seed: int,
+                                      **kwargs: Any) -> RankingPyEnvironment:
+  """Creates a shard of a `ShardedRankingPyEnvironment` in its own process."""
+  # The sampling functions typically draw from the global NumPy random state,
+  # which forked processes inherit. Without reseeding, all shards would sample
+  # the same observations.
+  np.random.seed(shard_seed)
+  return RankingPyEnvironment(seed=shard_seed, **kwargs)
+
+
+class ShardedRankingPyEnvironment(py_environment.PyEnvironment):
+  """Splits the batch of a `RankingPyEnvironment` across external processes.
+
+  Every shard is a `RankingPyEnvironment` with batch size
+  `batch_size // num_shards`, living in its own process. Observations and
+  rewards of the shards are concatenated along the batch dimension. This pays
+  off when the sampling functions are expensive Python callables; for cheap
+  NumPy samplers the inter-process communication dominates.
+  """
+
+  def __init__(self,
+               num_shards: int,
+               batch_size: int,
+               seed: Optional[int] = None,
+               start_serially: bool = True,
+               **kwargs: Any):
+    """Initializes the environment.
+
+    Args:
+      num_shards: (int) The number of processes to split the batch across.
+      batch_size: The batch size. Must be divisible by `num_shards`.
+      seed: An optional seed. Every shard gets a different seed derived from it,
+        used both for the global NumPy random state of its process and for its
+        user model.
+      start_serially: Whether to start the shards serially or in parallel.
+      **kwargs: Arguments passed on to the `RankingPyEnvironment` of every
+        shard, for example the sampling functions, `num_items` and `num_slots`.
+
+    Raises:
+      ValueError: If `num_shards` is less than 1, or `batch_size` is not
+        divisible by `num_shards`.
+    """
+    if num_shards < 1:
+      raise ValueError(
+          'The number of shards must be at least 1, got {}.'.format(num_shards))
+    if batch_size % num_shards:
+      raise ValueError(
+          'The batch size ({}) must be divisible by the number of shards '
+          '({}).'.format(batch_size, num_shards))
+    super(ShardedRankingPyEnvironment, self).__init__()
+    self._batch_size = batch_size
+    shard_seeds = [
+        int(seed_sequence.generate_state(1)[0])
+        for seed_sequence in np.random.SeedSequence(seed).spawn(num_shards)
+    ]
+    self._envs = [
+        parallel_py_environment.ProcessPyEnvironment(
+            functools.partial(
+                _create_ranking_environment_shard,
+                shard_seed,
+                batch_size=batch_size // num_shards,
+                **kwargs)) for shard_seed in shard_seeds
+    ]
+    for env in self._envs:
+      env.start(wait_to_start=start_serially)
+    if not start_serially:
+      for env in self._envs:
+        env.wait_start()
+    self._time_step_spec = self._envs[0].time_step_spec()
+    self._action_spec = self._envs[0].action_spec()
+
+  @property
+  def batched(self) -> bool:
+    return True
+
+  @property
+  def batch_size(self) -> int:
+    return self._batch_size
+
+  def observation_spec(self) -> types.NestedArraySpec:
+    return self._time_step_spec.observation
+
+  def action_spec(self) -> types.NestedArraySpec:
+    return self._action_spec
+
+  def reward_spec(self) -> types.NestedArraySpec:
+    return self._time_step_spec.reward
+
+  def time_step_spec(self) -> ts.TimeStep:
+    return self._time_step_spec
+
+  def _reset(self) -> ts.TimeStep:
+    promises = [env.reset(blocking=False) for env in self._envs]
+    return self._concatenate_time_steps([promise() for promise in promises])
+
+  def _step(self, action: types.NestedArray) -> ts.TimeStep:
+    promises = [
+        env.step(shard_action, blocking=False)
+        for env, shard_action in zip(self._envs,
+                                     np.split(action, len(self._envs)))
+    ]
+    return self._concatenate_time_steps([promise() for promise in promises])
+
+  def close(self) -> None:
+    for env in self._envs:
+      env.close()
+
+  def _concatenate_time_steps(self, time_steps):
+    return nest_utils.fast_map_structure(
+        lambda *arrays: np.concatenate(arrays), *time_steps)
 
 
 class ExplicitPositionalBiasRankingEnvironment(
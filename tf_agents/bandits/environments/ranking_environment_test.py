@@ -21,6 +21,7 @@ import tensorflow as tf  # pylint: disable=g-explicit-tensorflow-version-import
 from tf_agents.bandits.environments import ranking_environment
 from tf_agents.policies import random_py_policy
 from tf_agents.specs import array_spec
+from tf_agents.system import system_multiprocessing as multiprocessing
 
 
 def normal_with_sigma_1_sampler(mu):
@@ -36,6 +37,39 @@ def check_unbatched_time_step_spec(time_step, time_step_spec, batch_size):
       time_step, array_spec.add_outer_dims_nest(time_step_spec, (batch_size,)))
 
 
+def make_ranking_environment(
+    environment_class=ranking_environment.RankingPyEnvironment, **kwargs):
+  """Builds a ranking environment, with `kwargs` overriding the defaults.
+
+  The default sampling functions draw random integer features, with dimensions
+  matching the scores weight matrix, by default a fixed `[5, 4]` matrix.
+
+  Args:
+    environment_class: `RankingPyEnvironment` or `ShardedRankingPyEnvironment`.
+    **kwargs: Arguments of the environment constructor.
+
+  Returns:
+    The environment.
+  """
+  scores_weight_matrix = kwargs.setdefault(
+      'scores_weight_matrix',
+      (np.reshape(np.arange(20, dtype=float), newshape=[5, 4]) - 10) / 5)
+  item_dim, global_dim = np.shape(scores_weight_matrix)
+
+  def _global_sampling_fn():
+    return np.random.randint(-10, 10, [global_dim])
+
+  def _item_sampling_fn():
+    return np.random.randint(-2, 3, [item_dim])
+
+  kwargs.setdefault('global_sampling_fn', _global_sampling_fn)
+  kwargs.setdefault('item_sampling_fn', _item_sampling_fn)
+  kwargs.setdefault('num_items', 7)
+  kwargs.setdefault('num_slots', 5)
+  kwargs.setdefault('batch_size', 3)
+  return environment_class(**kwargs)
+
+
 class LinearNormalReward(object):
 
   def __init__(self, theta):
@@ -76,10 +110,31 @@ class RankingPyEnvironmentTest(tf.test.TestCase, parameterized.TestCase):
       'click_model': ranking_environment.ClickModel.DISTANCE_BASED,
       'real_cascade': False,
 
+  }, {
+      'batch_size': 8,
+      'global_dim': 6,
+      'item_dim': 4,
+      'num_items': 11,
+      'num_slots': 5,
+      'feedback_model': ranking_environment.FeedbackModel.MULTI_CLICK,
+      'click_model': ranking_environment.ClickModel.GHOST_ACTIONS,
+      'real_cascade': False,
+      'integer_weights': True,
+  }, {
+      'batch_size': 4,
+      'global_dim': 6,
+      'item_dim': 4,
+      'num_items': 11,
+      'num_slots': 5,
+      'feedback_model': ranking_environment.FeedbackModel.MULTI_CLICK,
+      'click_model': ranking_environment.ClickModel.DISTANCE_BASED,
+      'real_cascade': False,
+      'integer_weights': True,
   }])
   def test_ranking_environment(self, batch_size, global_dim, item_dim,
                                num_items, num_slots, feedback_model,
-                               click_model, real_cascade):
+                               click_model, real_cascade,
+                               integer_weights=False):
 
     def _global_sampling_fn():
       return np.random.randint(-10, 10, [global_dim])
@@ -87,9 +142,11 @@ class RankingPyEnvironmentTest(tf.test.TestCase, parameterized.TestCase):
     def _item_sampling_fn():
       return np.random.randint(-2, 3, [item_dim])
 
-    scores_weight_matrix = (np.reshape(
-        np.arange(global_dim * item_dim, dtype=float),
-        newshape=[item_dim, global_dim]) - 10) / 5
+    scores_weight_matrix = np.reshape(
+        np.arange(global_dim * item_dim),
+        newshape=[item_dim, global_dim]) - 10
+    if not integer_weights:
+      scores_weight_matrix = scores_weight_matrix / 5
 
     env = ranking_environment.RankingPyEnvironment(
         _global_sampling_fn,
@@ -127,6 +184,282 @@ class RankingPyEnvironmentTest(tf.test.TestCase, parameterized.TestCase):
         self.assertAllEqual(reward['chosen_value'].shape, [batch_size])
       else:
         self.assertAllEqual(reward.shape, [batch_size, num_slots])
+      if feedback_model == ranking_environment.FeedbackModel.MULTI_CLICK:
+        self.assertAllInSet(reward, [0., 1.])
+
+  def test_batched_sampling_fns(self):
+    batch_size = 3
+    global_dim = 4
+    item_dim = 5
+
+    def _global_sampling_fn_batched(n):
+      return np.random.randint(-10, 10, [n, global_dim])
+
+    def _item_sampling_fn_batched(n):
+      return np.random.randint(-2, 3, [n, item_dim])
+
+    env = make_ranking_environment(
+        batch_size=batch_size,
+        global_sampling_fn_batched=_global_sampling_fn_batched,
+        item_sampling_fn_batched=_item_sampling_fn_batched)
+    time_step_spec = env.time_step_spec()
+    random_policy = random_py_policy.RandomPyPolicy(
+        time_step_spec=time_step_spec, action_spec=env.action_spec())
+
+    time_step = env.reset()
+    self.assertTrue(
+        check_unbatched_time_step_spec(
+            time_step=time_step,
+            time_step_spec=time_step_spec,
+            batch_size=batch_size))
+    action = random_policy.action(time_step).action
+    time_step = env.step(action)
+    self.assertAllEqual(time_step.reward['chosen_index'].shape, [batch_size])
+    self.assertAllEqual(time_step.reward['chosen_value'].shape, [batch_size])
+
+  def test_explicit_dims_skip_sampler_probing(self):
+    batch_size = 3
+    global_dim = 4
+    item_dim = 5
+    num_items = 7
+
+    def _unbatched_sampling_fn():
+      raise AssertionError('The unbatched sampling functions must not be '
+                           'called.')
+
+    def _global_sampling_fn_batched(n):
+      return np.random.randint(-10, 10, [n, global_dim])
+
+    def _item_sampling_fn_batched(n):
+      return np.random.randint(-2, 3, [n, item_dim])
+
+    env = make_ranking_environment(
+        global_sampling_fn=_unbatched_sampling_fn,
+        item_sampling_fn=_unbatched_sampling_fn,
+        num_items=num_items,
+        batch_size=batch_size,
+        global_sampling_fn_batched=_global_sampling_fn_batched,
+        item_sampling_fn_batched=_item_sampling_fn_batched,
+        dtype=np.float32,
+        global_dim=global_dim,
+        item_dim=item_dim)
+    self.assertEqual(
+        env.observation_spec(), {
+            ranking_environment.GLOBAL_KEY:
+                array_spec.ArraySpec((global_dim,), np.float32),
+            ranking_environment.PER_ARM_KEY:
+                array_spec.ArraySpec((num_items, item_dim), np.float32),
+        })
+
+    time_step = env.reset()
+    self.assertTrue(
+        check_unbatched_time_step_spec(
+            time_step=time_step,
+            time_step_spec=env.time_step_spec(),
+            batch_size=batch_size))
+
+  @parameterized.named_parameters(
+      ('global_dim_without_dtype', {
+          'global_dim': 4,
+          'item_dim': 5
+      }, 'set together'),
+      ('item_dim_without_global_dim', {
+          'item_dim': 5,
+          'dtype': np.float32
+      }, 'set together'),
+      ('mismatched_global_dim', {
+          'global_dim': 3,
+          'item_dim': 5,
+          'dtype': np.float32
+      }, 'scores_weight_matrix'),
+      ('mismatched_sampled_dim', {
+          'global_sampling_fn': lambda: np.zeros([2])
+      }, 'scores_weight_matrix'))
+  def test_invalid_dims(self, env_kwargs, error_regex):
+    with self.assertRaisesRegex(ValueError, error_regex):
+      make_ranking_environment(**env_kwargs)
+
+  def test_seed_makes_clicks_deterministic(self):
+    batch_size = 16
+    num_slots = 5
+    action = np.tile(np.arange(num_slots, dtype=np.int32), [batch_size, 1])
+
+    rewards = []
+    for _ in range(2):
+      np.random.seed(0)
+      env = make_ranking_environment(
+          num_slots=num_slots, batch_size=batch_size, seed=12345)
+      env.reset()
+      rewards.append(env.step(action).reward)
+    self.assertAllEqual(rewards[0]['chosen_index'], rewards[1]['chosen_index'])
+    self.assertAllEqual(rewards[0]['chosen_value'], rewards[1]['chosen_value'])
+
+  def test_observation_dtype(self):
+    batch_size = 3
+    env = make_ranking_environment(batch_size=batch_size, dtype=np.float32)
+    time_step_spec = env.time_step_spec()
+    random_policy = random_py_policy.RandomPyPolicy(
+        time_step_spec=time_step_spec, action_spec=env.action_spec())
+
+    time_step = env.reset()
+    self.assertTrue(
+        check_unbatched_time_step_spec(
+            time_step=time_step,
+            time_step_spec=time_step_spec,
+            batch_size=batch_size))
+    self.assertEqual(
+        time_step.observation[ranking_environment.GLOBAL_KEY].dtype,
+        np.float32)
+    self.assertEqual(
+        time_step.observation[ranking_environment.PER_ARM_KEY].dtype,
+        np.float32)
+    # The whole scoring pipeline stays in single precision.
+    self.assertEqual(env._scores_dtype, np.float32)
+    self.assertEqual(env._buf_scores.dtype, np.float32)
+    self.assertEqual(env._buf_noise.dtype, np.float32)
+    action = random_policy.action(time_step).action
+    time_step = env.step(action)
+    self.assertAllEqual(time_step.reward['chosen_index'].shape, [batch_size])
+
+  def test_ghost_actions_click_distribution(self):
+    batch_size = 20000
+    item_dim = 2
+    num_slots = 3
+    scores_weight_matrix = np.array([[0.5, -0.3], [0.2, 0.4]])
+    env = make_ranking_environment(
+        num_items=3,
+        num_slots=num_slots,
+        scores_weight_matrix=scores_weight_matrix,
+        batch_size=batch_size,
+        seed=1)
+
+    global_obs = np.tile(np.array([[1., 2.]]), [batch_size, 1])
+    slotted_items = np.tile(
+        np.array([[[2., 1.], [-1., 0.], [0., -2.]]]), [batch_size, 1, 1])
+    chosen_items = env._choose_items_ghost_actions(
+        np.matmul(global_obs, scores_weight_matrix.T), slotted_items)
+    frequencies = np.bincount(
+        chosen_items, minlength=num_slots + 1) / batch_size
+
+    # The expected click probabilities of the sigmoid-normalize user model:
+    # normalized sigmoids of the noisy scores, averaged over the noise.
+    items_with_units = np.concatenate(
+        [slotted_items[0], np.identity(item_dim)], axis=0)
+    scores = np.matmul(
+        np.matmul(items_with_units, scores_weight_matrix), global_obs[0])
+    perturbed_scores = scores + np.random.RandomState(0).normal(
+        size=[100000, num_slots + item_dim])
+    unnormalized_probabilities = 1 / (1 + np.exp(-perturbed_scores))
+    probabilities = np.mean(
+        unnormalized_probabilities /
+        np.sum(unnormalized_probabilities, axis=-1, keepdims=True), axis=0)
+    expected_frequencies = np.append(
+        probabilities[:num_slots], np.sum(probabilities[num_slots:]))
+    self.assertAllClose(frequencies, expected_frequencies, atol=0.015)
+
+  def test_gumbel_perturbed_logits_zero_uniforms(self):
+    env = make_ranking_environment()
+
+    # The uniform sampler can return exactly 0, which must not reach the log.
+    scores = np.ones([4, 5])
+    normal_noise = np.zeros([4, 5])
+    uniforms = np.zeros([4, 5])
+    with np.errstate(all='raise'):
+      logits = env._gumbel_perturbed_logits(scores, normal_noise, uniforms)
+    self.assertTrue(np.all(np.isfinite(logits)))
+
+  def test_sharded_ranking_environment(self):
+    batch_size = 6
+    env = make_ranking_environment(
+        ranking_environment.ShardedRankingPyEnvironment,
+        num_shards=2,
+        batch_size=batch_size,
+        seed=1)
+    time_step_spec = env.time_step_spec()
+    random_policy = random_py_policy.RandomPyPolicy(
+        time_step_spec=time_step_spec, action_spec=env.action_spec())
+
+    time_step = env.reset()
+    self.assertTrue(
+        check_unbatched_time_step_spec(
+            time_step=time_step,
+            time_step_spec=time_step_spec,
+            batch_size=batch_size))
+    # The shards must not sample identical observations.
+    global_obs = time_step.observation[ranking_environment.GLOBAL_KEY]
+    self.assertNotAllEqual(global_obs[:batch_size // 2],
+                           global_obs[batch_size // 2:])
+
+    action = random_policy.action(time_step).action
+    time_step = env.step(action)
+    self.assertAllEqual(time_step.reward['chosen_index'].shape, [batch_size])
+    self.assertAllEqual(time_step.reward['chosen_value'].shape, [batch_size])
+    env.close()
+
+  @parameterized.parameters([(0,), (-2,), (4,)])
+  def test_sharded_ranking_environment_invalid_num_shards(self, num_shards):
+    with self.assertRaisesRegex(ValueError, 'shards'):
+      ranking_environment.ShardedRankingPyEnvironment(
+          num_shards=num_shards, batch_size=6)
+
+  @parameterized.parameters([{
+      'real_cascade': False,
+      'expected_chosen_items': [2, 3, 0],
+  }, {
+      'real_cascade': True,
+      'expected_chosen_items': [1, 3, 0],
+  }])
+  def test_choose_items_distance_based(self, real_cascade,
+                                       expected_chosen_items):
+    batch_size = 3
+    env = make_ranking_environment(
+        num_items=4,
+        num_slots=3,
+        scores_weight_matrix=np.identity(2),
+        click_model=ranking_environment.ClickModel.DISTANCE_BASED,
+        real_cascade=real_cascade,
+        distance_threshold=1.0,
+        batch_size=batch_size)
+
+    # With the identity weight matrix, the projected globals equal the global
+    # features, and with the ones below, the score of an item is its first
+    # feature.
+    global_proj = np.tile(np.array([[1., 0.]]), [batch_size, 1])
+    slotted_items = np.array([[[0., 0.], [1., 0.], [3., 0.]],
+                              [[0., 0.], [0.5, 0.], [-1., 0.]],
+                              [[1., 0.], [1., 0.], [0., 0.]]])
+    chosen_items = env._choose_items_distance_based(global_proj, slotted_items)
+    self.assertAllEqual(chosen_items, expected_chosen_items)
+
+  @parameterized.parameters([(-30, 0.), (30, 1.)])
+  def test_multi_click_ghost_actions_click_rate(self, score,
+                                                expected_click_rate):
+    batch_size = 1000
+    num_slots = 3
+    env = make_ranking_environment(
+        num_items=4,
+        num_slots=num_slots,
+        scores_weight_matrix=np.array([[1, 0], [0, 1]]),
+        feedback_model=ranking_environment.FeedbackModel.MULTI_CLICK,
+        click_model=ranking_environment.ClickModel.GHOST_ACTIONS,
+        batch_size=batch_size,
+        seed=1)
+
+    # Every slotted item has the same score, far from zero, so it is clicked
+    # with probability close to 0 or 1, regardless of the other slots. The
+    # features and the weights are integers, so are the inner products.
+    global_proj = np.tile(np.array([[1, 0]]), [batch_size, 1])
+    slotted_items = np.tile(np.array([[[score, 0]]]),
+                            [batch_size, num_slots, 1])
+    clicks = env._click_vector(global_proj, slotted_items)
+    self.assertAllEqual(clicks.shape, [batch_size, num_slots])
+    self.assertAllClose(np.mean(clicks), expected_click_rate, atol=1e-3)
+
+  def test_multi_click_rejects_real_cascade(self):
+    with self.assertRaisesRegex(ValueError, 'real_cascade'):
+      make_ranking_environment(
+          feedback_model=ranking_environment.FeedbackModel.MULTI_CLICK,
+          real_cascade=True)
 
   def test_cascading_to_scorevector(self):
     batch_size = 5
@@ -228,4 +561,4 @@ class ExplicitBiasEnvironmentTest(tf.test.TestCase, parameterized.TestCase):
 
 
 if __name__ == '__main__':
-  tf.test.main()
+  multiprocessing.handle_test_main(tf.test.main)